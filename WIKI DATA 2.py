@@ -6,11 +6,28 @@ BANDEAU VERSION ULTRA VISIBLE + LOGS TEMPS RÉEL
 
 import streamlit as st
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import time
-from dataclasses import dataclass, asdict
-from typing import List, Dict
+import random
+import html
+import re
+import threading
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from itertools import islice
+from dataclasses import dataclass, asdict, field
+from typing import List, Dict, Tuple
 from datetime import datetime
+from urllib.parse import urlparse
+from email.utils import parsedate_to_datetime
+
+try:
+    import orjson
+except ImportError:  # fallback stdlib
+    orjson = None
 
 # ============================================================================
 # ⚠️ VERSION - MODIFIER ICI POUR VÉRIFIER LE DÉPLOIEMENT
@@ -19,6 +36,14 @@ VERSION = "9.2.0"
 BUILD_DATE = "2025-01-19"
 BUILD_ID = "BUILD-2025JAN19-1530"  # Change ce ID à chaque push
 
+# Cache API partagé entre sessions: TTL (secondes) par espace de noms
+API_CACHE_TTL = {"wd_search": 60, "wd_entity": 86400, "insee_search": 600}
+API_CACHE_MAX = 512
+DISK_CACHE_PATH = "/tmp/aas_cache.sqlite"
+DISK_CACHE_KEEP = 7 * 86400  # entrées expirées conservées pour le repli "stale"
+
+WIKI_RESULTS_SHOWN = 8  # résultats Wikidata affichés (= limit demandé à l'API)
+
 # ============================================================================
 # CONFIG
 # ============================================================================
@@ -51,7 +76,7 @@ st.markdown(f"""
 # SESSION STATE
 # ============================================================================
 if 'logs' not in st.session_state:
-    st.session_state.logs = []
+    st.session_state.logs = deque(maxlen=100)
 if 'entity' not in st.session_state:
     st.session_state.entity = None
 if 'wiki_results' not in st.session_state:
@@ -64,20 +89,155 @@ if 'mistral_key' not in st.session_state:
     st.session_state.mistral_key = ''
 
 
+LOG_ICONS = {"INFO": "ℹ️", "OK": "✅", "ERROR": "❌", "WARN": "⚠️", "HTTP": "🌐", "DEBUG": "🔧"}
+
+
+# Tampon de logs par thread: les workers n'écrivent jamais dans session_state
+_log_sink = threading.local()
+
+
 def log(msg: str, level: str = "INFO"):
     """Log avec timestamp."""
     ts = datetime.now().strftime("%H:%M:%S.%f")[:-3]
-    icons = {"INFO": "ℹ️", "OK": "✅", "ERROR": "❌", "WARN": "⚠️", "HTTP": "🌐", "DEBUG": "🔧"}
-    entry = f"{icons.get(level, '•')} [{ts}] {msg}"
-    st.session_state.logs.append(entry)
-    if len(st.session_state.logs) > 100:
-        st.session_state.logs = st.session_state.logs[-100:]
+    entry = f"{LOG_ICONS.get(level, '•')} [{ts}] {msg}"
+    sink = getattr(_log_sink, "entries", None)
+    if sink is not None:
+        sink.append(entry)
+    else:
+        st.session_state.logs.append(entry)
+
+
+def run_collecting_logs(fn, *args) -> Tuple[object, List[str]]:
+    """Exécute fn dans un worker et renvoie (résultat, logs) à verser côté thread principal."""
+    _log_sink.entries = []
+    try:
+        return fn(*args), _log_sink.entries
+    finally:
+        _log_sink.entries = None
+
+
+# ============================================================================
+# JSON
+# ============================================================================
+def loads(data: bytes):
+    """Désérialisation JSON (orjson si dispo, sinon json)."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj, indent: bool = False) -> str:
+    """Sérialisation JSON (orjson si dispo, sinon json)."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0).decode()
+    return json.dumps(obj, indent=2 if indent else None, ensure_ascii=False)
+
+
+# ============================================================================
+# CACHE API
+# ============================================================================
+@st.cache_resource
+def api_cache() -> Tuple[Dict, threading.Lock]:
+    """Store du cache API, commun à toutes les sessions du process."""
+    return {}, threading.Lock()
+
+
+@st.cache_resource
+def disk_cache() -> Tuple[sqlite3.Connection, threading.Lock]:
+    """Cache API sur disque (SQLite): survit aux redémarrages du process."""
+    conn = sqlite3.connect(DISK_CACHE_PATH, check_same_thread=False)
+    conn.execute("CREATE TABLE IF NOT EXISTS cache (ns TEXT, key TEXT, ts REAL, value TEXT, PRIMARY KEY (ns, key))")
+    conn.execute("DELETE FROM cache WHERE ts < ?", (time.time() - DISK_CACHE_KEEP,))
+    conn.commit()
+    return conn, threading.Lock()
+
+
+def _disk_get(ns: str, key: str):
+    """(timestamp, valeur) depuis le disque, ou None."""
+    try:
+        conn, lock = disk_cache()
+        with lock:
+            row = conn.execute("SELECT ts, value FROM cache WHERE ns = ? AND key = ?", (ns, key)).fetchone()
+        return (row[0], loads(row[1])) if row else None
+    except (sqlite3.Error, ValueError) as e:  # ligne illisible = absente
+        log(f"Cache disque indisponible: {e}", "DEBUG")
+        return None
+
+
+def _mem_put(ns: str, key: str, hit: Tuple):
+    """Insère en mémoire (éviction des plus anciennes entrées au-delà de API_CACHE_MAX)."""
+    cache, lock = api_cache()
+    with lock:
+        cache.pop((ns, key), None)
+        cache[(ns, key)] = hit
+        while len(cache) > API_CACHE_MAX:
+            del cache[next(iter(cache))]
+
+
+def cache_get(ns: str, key: str):
+    """Valeur en cache si présente et non expirée (mémoire puis disque), sinon None."""
+    cache, lock = api_cache()
+    with lock:
+        hit = cache.get((ns, key))
+    if not hit:
+        hit = _disk_get(ns, key)
+        if hit:
+            _mem_put(ns, key, hit)
+    if hit and time.time() - hit[0] < API_CACHE_TTL[ns]:
+        return hit[1]
+    return None
+
+
+def cache_stale(ns: str, key: str):
+    """Dernière valeur connue, même expirée (repli quand l'API échoue), sinon None."""
+    cache, lock = api_cache()
+    with lock:
+        hit = cache.get((ns, key))
+    hit = hit or _disk_get(ns, key)
+    if hit:
+        log(f"Réponse en cache périmée ({ns}: {key}, {round(time.time() - hit[0])}s)", "WARN")
+        return hit[1]
+    return None
+
+
+def cache_put(ns: str, key: str, value):
+    """Met en cache en mémoire et sur disque."""
+    hit = (time.time(), value)
+    _mem_put(ns, key, hit)
+    try:
+        conn, lock = disk_cache()
+        with lock:
+            conn.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)", (ns, key, hit[0], dumps(value)))
+            conn.commit()
+    except sqlite3.Error as e:
+        log(f"Cache disque indisponible: {e}", "DEBUG")
 
 
 # ============================================================================
 # DATA CLASS
 # ============================================================================
-@dataclass
+ORG_TYPES = ("Organization", "Corporation", "LocalBusiness", "BankOrCreditUnion")
+ORG_TYPE_INDEX = {t: i for i, t in enumerate(ORG_TYPES)}
+
+# Formats d'identifiants
+QID_RE = re.compile(r'^Q\d{1,12}$')
+SIREN_RE = re.compile(r'^\d{9}$')
+LEI_RE = re.compile(r'^[A-Z0-9]{20}$')
+NON_DIGIT_RE = re.compile(r'\D')
+
+
+def clean_siren(siren: str) -> str:
+    """SIREN sur 9 chiffres (espaces/points retirés)."""
+    if len(siren) == 9 and siren.isdigit():
+        return siren
+    return NON_DIGIT_RE.sub('', siren)[:9]
+
+
+# (champ, poids) du score d'autorité
+SCORE_WEIGHTS = (("qid", 25), ("siren", 25), ("lei", 15), ("website", 15), ("parent_org_qid", 20))
+
+
+@dataclass(slots=True)
 class Entity:
     name: str = ""
     name_en: str = ""
@@ -96,27 +256,127 @@ class Entity:
     address: str = ""
 
     def score(self) -> int:
-        s = 0
-        if self.qid: s += 25
-        if self.siren: s += 25
-        if self.lei: s += 15
-        if self.website: s += 15
-        if self.parent_org_qid: s += 20
-        return min(s, 100)
+        return min(sum(w for f, w in SCORE_WEIGHTS if getattr(self, f)), 100)
 
 
 if st.session_state.entity is None:
     st.session_state.entity = Entity()
 
 
+# ============================================================================
+# HTTP + CIRCUIT BREAKER
+# ============================================================================
+class CircuitOpen(Exception):
+    """Hôte en échec répété: appel refusé sans attendre le timeout."""
+
+
+@dataclass
+class CircuitBreaker:
+    threshold: int = 5
+    reset_after: float = 30.0
+    fails: int = 0
+    opened_at: float = 0.0
+    probing: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def is_open(self) -> bool:
+        # Après reset_after, un seul appel passe (semi-ouvert) jusqu'à son record()
+        with self.lock:
+            if self.fails < self.threshold:
+                return False
+            if self.probing or time.time() - self.opened_at < self.reset_after:
+                return True
+            self.probing = True
+            return False
+
+    def record(self, ok: bool):
+        with self.lock:
+            self.probing = False
+            if ok:
+                self.fails = 0
+            else:
+                self.fails += 1
+                if self.fails >= self.threshold:
+                    self.opened_at = time.time()
+
+
+@st.cache_resource
+def http_session() -> requests.Session:
+    """Session HTTP unique du process: keep-alive, pas de handshake TLS à chaque appel."""
+    session = requests.Session()
+    session.headers.update({
+        "User-Agent": f"AAS-Bot/{VERSION} (Streamlit Cloud; contact@example.com)",
+        "Accept": "application/json"
+    })
+    # Pool de connexions + retry transport sur 502/503/504 uniquement
+    # (pas sur connect/read: les timeouts remontent tels quels; les 429 sont gérés par l'appelant)
+    # Retry-After ignoré ici: les attentes longues restent bornées par _sleep_for_retry
+    session.mount("https://", HTTPAdapter(
+        pool_connections=10,
+        pool_maxsize=20,
+        max_retries=Retry(total=None, connect=0, read=0, status=2, backoff_factor=0.5,
+                          status_forcelist=[502, 503, 504], allowed_methods=["GET"],
+                          respect_retry_after_header=False, raise_on_status=False)
+    ))
+    return session
+
+
+@st.cache_resource
+def circuit_breakers() -> Dict[str, CircuitBreaker]:
+    """Un breaker par hôte, partagé entre sessions."""
+    return {}
+
+
+def http_get(url: str, **kwargs):
+    """GET via la session partagée, protégé par le breaker de l'hôte."""
+    host = urlparse(url).netloc
+    breaker = circuit_breakers().setdefault(host, CircuitBreaker())
+    if breaker.is_open():
+        wait = max(0, round(breaker.reset_after - (time.time() - breaker.opened_at)))
+        raise CircuitOpen(f"{host} indisponible ({breaker.fails} échecs), réessai dans {wait}s")
+    try:
+        response = http_session().get(url, **kwargs)
+    except Exception:  # toute erreur libère la sonde semi-ouverte
+        breaker.record(False)
+        raise
+    breaker.record(response.status_code < 500)
+    return response
+
+
+def _sleep_for_retry(resp, attempt: int, base: float = 1.0, cap: float = 30.0, jitter: float = 0.5):
+    """Attend avant un nouvel essai: Retry-After s'il est fourni, sinon backoff exponentiel avec jitter."""
+    wait = None
+    retry_after = resp.headers.get("Retry-After")
+    if retry_after:
+        try:
+            wait = float(retry_after)
+        except ValueError:
+            try:
+                wait = parsedate_to_datetime(retry_after).timestamp() - time.time()
+            except (TypeError, ValueError):
+                wait = None
+    if wait is None:
+        wait = base * 2 ** attempt * (1 + random.random() * jitter)
+    wait = round(min(cap, max(0.0, wait)), 2)
+    log(f"Rate limit {resp.status_code} - Attente {wait}s", "WARN")
+    time.sleep(wait)
+
+
 # ============================================================================
 # WIKIDATA API
 # ============================================================================
-def wikidata_search(query: str) -> List[Dict]:
+def wikidata_search(query: str, use_cache: bool = True) -> List[Dict]:
     """Recherche Wikidata avec logs."""
     
     log(f"{'='*50}", "INFO")
     log(f"WIKIDATA SEARCH: '{query}'", "INFO")
+    
+    key = " ".join(query.lower().split())
+    results = cache_get("wd_search", key) if use_cache else None
+    if results is not None:
+        log(f"✅ Cache: {len(results)} résultats", "OK")
+        return results
+    
     log(f"Version: {VERSION} | Build: {BUILD_ID}", "DEBUG")
     
     url = "https://www.wikidata.org/w/api.php"
@@ -126,16 +386,14 @@ def wikidata_search(query: str) -> List[Dict]:
         "language": "fr",
         "uselang": "fr",
         "format": "json",
-        "limit": 10,
+        "limit": WIKI_RESULTS_SHOWN,
         "type": "item",
+        "props": "",  # pas d'URL par résultat: seuls id/label/description sont lus
+        "formatversion": "2",
+        "errorformat": "plaintext",
         "origin": "*"
     }
     
-    headers = {
-        "User-Agent": f"AAS-Bot/{VERSION} (Streamlit Cloud; contact@example.com)",
-        "Accept": "application/json"
-    }
-    
     log(f"URL: {url}", "DEBUG")
     log(f"Params: action=wbsearchentities, search={query}", "DEBUG")
     
@@ -144,13 +402,13 @@ def wikidata_search(query: str) -> List[Dict]:
             log(f"Tentative {attempt+1}/3...", "HTTP")
             
             t0 = time.time()
-            response = requests.get(url, params=params, headers=headers, timeout=30)
+            response = http_get(url, params=params, timeout=30)
             elapsed = round(time.time() - t0, 2)
             
             log(f"HTTP {response.status_code} en {elapsed}s", "HTTP")
             
             if response.status_code == 200:
-                data = response.json()
+                data = loads(response.content)
                 
                 if 'search' in data:
                     results = data['search']
@@ -159,28 +417,34 @@ def wikidata_search(query: str) -> List[Dict]:
                     for item in results[:3]:
                         log(f"  → {item['id']}: {item.get('label', '?')}", "DEBUG")
                     
-                    return [{
+                    # Dédoublonnage par QID (alias menant à la même entité)
+                    results = list({item['id']: {
                         'qid': item['id'],
                         'label': item.get('label', item['id']),
                         'desc': item.get('description', '')
-                    } for item in results]
+                    } for item in results}.values())
+                    if use_cache:
+                        cache_put("wd_search", key, results)
+                    return results
                 else:
                     log(f"❌ Pas de 'search' dans réponse", "ERROR")
                     log(f"Clés: {list(data.keys())}", "DEBUG")
-                    if 'error' in data:
-                        log(f"API Error: {data['error']}", "ERROR")
+                    for err in data.get('errors', []):
+                        log(f"API Error: {err.get('code', '?')}: {err.get('text', '')}", "ERROR")
                     return []
             
             elif response.status_code == 429:
-                wait = 2 ** attempt
-                log(f"Rate limit 429 - Attente {wait}s", "WARN")
-                time.sleep(wait)
+                if attempt < 2:
+                    _sleep_for_retry(response, attempt)
                 continue
             
             else:
                 log(f"❌ HTTP {response.status_code}", "ERROR")
                 log(f"Response: {response.text[:200]}", "DEBUG")
                 
+        except CircuitOpen as e:
+            log(f"⛔ {e}", "ERROR")
+            return (cache_stale("wd_search", key) if use_cache else None) or []
         except requests.Timeout:
             log(f"⏱️ TIMEOUT 30s (tentative {attempt+1})", "ERROR")
             if attempt < 2:
@@ -192,134 +456,252 @@ def wikidata_search(query: str) -> List[Dict]:
             log(f"💥 EXCEPTION: {type(e).__name__}: {str(e)[:80]}", "ERROR")
     
     log(f"❌ ÉCHEC après 3 tentatives", "ERROR")
-    return []
+    return (cache_stale("wd_search", key) if use_cache else None) or []
 
 
-def wikidata_get_entity(qid: str) -> Dict:
-    """Récupère détails entité."""
+def wikidata_search_prefetch(query: str) -> List[Dict]:
+    """Recherche + préchargement des détails du top 5 en un seul appel (mis en cache)."""
+    results = wikidata_search(query)
+    details = wikidata_get_entities([r['qid'] for r in results[:5]], verbose=False)
+    if details:
+        log(f"Préchargement: {len(details)} entité(s)", "DEBUG")
+    return results
+
+
+def wikidata_get_labels(qids: List[str], verbose: bool = True) -> Dict[str, str]:
+    """Labels (fr, sinon en) de plusieurs QIDs en un seul appel (max 50)."""
     
-    log(f"GET ENTITY: {qid}", "INFO")
+    qids = [q for q in dict.fromkeys(qids) if q][:50]
+    if not qids:
+        return {}
     
-    result = {
-        "name_fr": "", "name_en": "", "desc_fr": "",
-        "siren": "", "lei": "", "website": "",
-        "parent_name": "", "parent_qid": ""
-    }
+    if verbose:
+        log(f"GET LABELS: {', '.join(qids)}", "INFO")
+    
+    labels = {}
+    try:
+        response = http_get("https://www.wikidata.org/w/api.php", params={
+            "action": "wbgetentities",
+            "ids": "|".join(qids),
+            "languages": "fr|en",
+            "props": "labels",
+            "format": "json"
+        }, timeout=10)
+        if verbose:
+            log(f"HTTP {response.status_code}", "HTTP")
+        
+        if response.status_code == 200:
+            for qid, entity in loads(response.content).get('entities', {}).items():
+                lbl = entity.get('labels', {})
+                labels[qid] = lbl.get('fr', {}).get('value', '') or lbl.get('en', {}).get('value', '')
+    except Exception as e:
+        log(f"Erreur labels: {e}", "WARN")
+    
+    return labels
+
+
+def wikidata_get_entities(qids: List[str], verbose: bool = True) -> Dict[str, Dict]:
+    """Récupère détails de plusieurs entités: 1 appel entités + 1 appel labels parents."""
+    
+    results = {}
+    missing = []
+    for q in dict.fromkeys(qids):
+        if not q:
+            continue
+        details = cache_get("wd_entity", q)
+        if details is not None:
+            results[q] = details
+        else:
+            missing.append(q)
+    missing = missing[:50]
+    if not missing:
+        return results
+    
+    if verbose:
+        log(f"GET ENTITIES: {', '.join(missing)}", "INFO")
     
     url = "https://www.wikidata.org/w/api.php"
     params = {
         "action": "wbgetentities",
-        "ids": qid,
+        "ids": "|".join(missing),
         "languages": "fr|en",
         "props": "labels|descriptions|claims",
         "format": "json"
     }
-    headers = {"User-Agent": f"AAS-Bot/{VERSION}"}
     
     try:
-        response = requests.get(url, params=params, headers=headers, timeout=30)
-        log(f"HTTP {response.status_code}", "HTTP")
+        for attempt in range(3):
+            response = http_get(url, params=params, timeout=30)
+            if verbose:
+                log(f"HTTP {response.status_code}", "HTTP")
+            if response.status_code != 429 or attempt == 2:
+                break
+            _sleep_for_retry(response, attempt)
         
         if response.status_code == 200:
-            data = response.json()
-            entity = data.get('entities', {}).get(qid, {})
-            
-            if entity:
-                labels = entity.get('labels', {})
-                descs = entity.get('descriptions', {})
-                claims = entity.get('claims', {})
-                
-                result["name_fr"] = labels.get('fr', {}).get('value', '')
-                result["name_en"] = labels.get('en', {}).get('value', '')
-                result["desc_fr"] = descs.get('fr', {}).get('value', '')
-                
-                log(f"Nom: {result['name_fr']}", "OK")
-                log(f"Claims disponibles: {len(claims)}", "DEBUG")
-                
-                # SIREN P1616
-                if 'P1616' in claims:
-                    try:
-                        result["siren"] = claims['P1616'][0]['mainsnak']['datavalue']['value']
-                        log(f"SIREN: {result['siren']}", "OK")
-                    except:
-                        pass
-                
-                # LEI P1278
-                if 'P1278' in claims:
-                    try:
-                        result["lei"] = claims['P1278'][0]['mainsnak']['datavalue']['value']
-                        log(f"LEI: {result['lei']}", "OK")
-                    except:
-                        pass
-                
-                # Website P856
-                if 'P856' in claims:
-                    try:
-                        result["website"] = claims['P856'][0]['mainsnak']['datavalue']['value']
-                        log(f"Website: {result['website']}", "OK")
-                    except:
-                        pass
-                
-                # Parent P749
-                if 'P749' in claims:
-                    try:
-                        pval = claims['P749'][0]['mainsnak']['datavalue']['value']
-                        if isinstance(pval, dict):
-                            result["parent_qid"] = pval.get('id', '')
-                        log(f"Parent QID: {result['parent_qid']}", "OK")
-                        
-                        if result["parent_qid"]:
-                            # Get parent name
-                            p_resp = requests.get(url, params={
-                                "action": "wbgetentities",
-                                "ids": result["parent_qid"],
-                                "languages": "fr|en",
-                                "props": "labels",
-                                "format": "json"
-                            }, headers=headers, timeout=10)
-                            if p_resp.status_code == 200:
-                                p_data = p_resp.json()
-                                p_labels = p_data.get('entities', {}).get(result["parent_qid"], {}).get('labels', {})
-                                result["parent_name"] = p_labels.get('fr', {}).get('value', '') or p_labels.get('en', {}).get('value', '')
-                                log(f"Parent: {result['parent_name']}", "OK")
-                    except Exception as e:
-                        log(f"Erreur P749: {e}", "WARN")
+            entities = loads(response.content).get('entities', {})
+            fetched = {}
+            for qid in missing:
+                entity = entities.get(qid, {})
+                if entity and 'missing' not in entity:
+                    fetched[qid] = _parse_entity(entity)
                 else:
-                    log("Pas de Parent (P749)", "DEBUG")
-                
-                log(f"✅ Entity chargée", "OK")
-            else:
-                log(f"Entity {qid} non trouvée", "ERROR")
+                    log(f"Entity {qid} non trouvée", "ERROR")
+            
+            # Labels de tous les parents en un seul appel
+            parent_qids = [r["parent_qid"] for r in fetched.values() if r["parent_qid"]]
+            if parent_qids:
+                parent_labels = wikidata_get_labels(parent_qids, verbose)
+                for r in fetched.values():
+                    if r["parent_qid"]:
+                        r["parent_name"] = parent_labels.get(r["parent_qid"], '')
+            
+            for qid, details in fetched.items():
+                cache_put("wd_entity", qid, details)
+            results.update(fetched)
+            if verbose:
+                log(f"✅ {len(fetched)} entité(s) chargée(s)", "OK")
+            return results
     except Exception as e:
         log(f"Exception: {e}", "ERROR")
     
+    for qid in missing:
+        stale = cache_stale("wd_entity", qid)
+        if stale is not None:
+            results[qid] = stale
+    return results
+
+
+# (clé du résultat, propriété Wikidata, sous-clé si la valeur est un dict, libellé log)
+CLAIM_MAP = (
+    ("siren", "P1616", None, "SIREN"),
+    ("lei", "P1278", None, "LEI"),
+    ("website", "P856", None, "Website"),
+    ("parent_qid", "P749", "id", "Parent QID"),  # label résolu en lot par wikidata_get_entities
+)
+
+EMPTY_DETAILS = {
+    "name_fr": "", "name_en": "", "desc_fr": "",
+    "siren": "", "lei": "", "website": "",
+    "parent_name": "", "parent_qid": ""
+}
+
+
+def _parse_entity(entity: Dict) -> Dict:
+    """Extrait noms, identifiants et parent (QID) d'une entité wbgetentities."""
+    
+    result = dict(EMPTY_DETAILS)
+    
+    labels = entity.get('labels', {})
+    descs = entity.get('descriptions', {})
+    claims = entity.get('claims', {})
+    
+    result["name_fr"] = labels.get('fr', {}).get('value', '')
+    result["name_en"] = labels.get('en', {}).get('value', '')
+    result["desc_fr"] = descs.get('fr', {}).get('value', '')
+    
+    for key, pid, nested, _ in CLAIM_MAP:
+        result[key] = _claim_value(claims, pid, nested)
+    
     return result
 
 
+def _log_details(details: Dict):
+    """Détail champ par champ d'une entité sélectionnée (pas lors du préchargement)."""
+    log(f"Nom: {details['name_fr']}", "OK")
+    for key, _, _, label in CLAIM_MAP:
+        if details[key]:
+            log(f"{label}: {details[key]}", "OK")
+    if details["parent_qid"]:
+        log(f"Parent: {details['parent_name']}", "OK")
+    else:
+        log("Pas de Parent (P749)", "DEBUG")
+
+
+def _claim_value(claims: Dict, pid: str, nested: str = None) -> str:
+    """Valeur du premier claim d'une propriété ('' si absente ou malformée)."""
+    snaks = claims.get(pid)
+    if not snaks:
+        return ""
+    value = snaks[0].get('mainsnak', {}).get('datavalue', {}).get('value', '')
+    if nested:
+        return value.get(nested, "") if isinstance(value, dict) else ""
+    return value if isinstance(value, str) else ""
+
+
+def wikidata_get_entity(qid: str) -> Dict:
+    """Récupère détails entité."""
+    
+    details = wikidata_get_entities([qid]).get(qid)
+    if details is None:
+        return dict(EMPTY_DETAILS)
+    _log_details(details)
+    return details
+
+
 def insee_search(query: str) -> List[Dict]:
     """Recherche INSEE."""
     log(f"INSEE SEARCH: '{query}'", "INFO")
     
+    key = " ".join(query.lower().split())
+    cached = cache_get("insee_search", key)
+    if cached is not None:
+        log(f"✅ Cache INSEE: {len(cached)} résultats", "OK")
+        return cached
+    
     try:
-        response = requests.get(
-            "https://recherche-entreprises.api.gouv.fr/search",
-            params={"q": query, "per_page": 10},
-            timeout=15
-        )
-        log(f"INSEE HTTP {response.status_code}", "HTTP")
+        for attempt in range(3):
+            response = http_get(
+                "https://recherche-entreprises.api.gouv.fr/search",
+                params={"q": query, "per_page": 10},
+                timeout=15
+            )
+            log(f"INSEE HTTP {response.status_code}", "HTTP")
+            if response.status_code != 429 or attempt == 2:
+                break
+            _sleep_for_retry(response, attempt)
         
         if response.status_code == 200:
-            results = response.json().get('results', [])
+            results = loads(response.content).get('results', [])
             log(f"INSEE: {len(results)} résultats", "OK")
-            return [{
+            # Dédoublonnage par SIREN
+            results = list({r['siren']: {
                 'siren': r.get('siren', ''),
                 'name': r.get('nom_complet', ''),
                 'address': f"{r.get('siege', {}).get('adresse', '')} {r.get('siege', {}).get('code_postal', '')} {r.get('siege', {}).get('commune', '')}",
                 'active': r.get('etat_administratif') == 'A'
-            } for r in results]
+            } for r in results if r.get('siren')}.values())
+            cache_put("insee_search", key, results)
+            return results
     except Exception as e:
         log(f"INSEE Error: {e}", "ERROR")
-    return []
+    return cache_stale("insee_search", key) or []
+
+
+# ============================================================================
+# EXPORT JSON-LD
+# ============================================================================
+@st.cache_data(max_entries=32, show_spinner=False)
+def export_json_ld(entity_d: Dict) -> str:
+    """JSON-LD sérialisé, recalculé uniquement si l'entité change."""
+    e = Entity(**entity_d)
+    # Inclusion conditionnelle: aucune clé à None à nettoyer ensuite
+    json_ld = {
+        "@context": "https://schema.org",
+        "@type": e.org_type,
+        "name": e.name,
+    }
+    if e.website:
+        json_ld["url"] = e.website
+    if SIREN_RE.match(e.siren):
+        json_ld["taxID"] = f"FR{e.siren}"
+    if QID_RE.match(e.qid):
+        json_ld["sameAs"] = f"https://www.wikidata.org/wiki/{e.qid}"
+    if e.parent_org_name:
+        json_ld["parentOrganization"] = {"@type": "Organization", "name": e.parent_org_name}
+        if QID_RE.match(e.parent_org_qid):
+            json_ld["parentOrganization"]["sameAs"] = f"https://www.wikidata.org/wiki/{e.parent_org_qid}"
+    return dumps(json_ld, indent=True)
 
 
 # ============================================================================
@@ -371,7 +753,7 @@ with log_col:
     c1, c2 = st.columns(2)
     with c1:
         if st.button("🗑️ Clear", use_container_width=True):
-            st.session_state.logs = []
+            st.session_state.logs.clear()
             st.rerun()
     with c2:
         if st.button("🔄 Refresh", use_container_width=True):
@@ -381,15 +763,20 @@ with log_col:
     log_box = st.container(height=450)
     with log_box:
         if st.session_state.logs:
-            for entry in reversed(st.session_state.logs[-30:]):
+            # Un seul st.markdown pour toute la console (au lieu d'un élément par ligne)
+            parts = ["<div style='font-family:monospace; font-size:13px; white-space:pre-wrap;'>"]
+            for entry in islice(reversed(st.session_state.logs), 30):
                 if "ERROR" in entry or "❌" in entry:
-                    st.markdown(f"<span style='color:#FF6B6B'>{entry}</span>", unsafe_allow_html=True)
+                    color = "#FF6B6B"
                 elif "OK" in entry or "✅" in entry:
-                    st.markdown(f"<span style='color:#4ECDC4'>{entry}</span>", unsafe_allow_html=True)
+                    color = "#4ECDC4"
                 elif "WARN" in entry or "⚠️" in entry:
-                    st.markdown(f"<span style='color:#FFE66D'>{entry}</span>", unsafe_allow_html=True)
+                    color = "#FFE66D"
                 else:
-                    st.text(entry)
+                    color = "inherit"
+                parts.append(f"<div style='color:{color}'>{html.escape(entry)}</div>")
+            parts.append("</div>")
+            st.markdown("".join(parts), unsafe_allow_html=True)
         else:
             st.info(f"Logs vides. Build: {BUILD_ID}")
 
@@ -418,7 +805,7 @@ with main_col:
     if test_btn:
         log(f"=== TEST API v{VERSION} ===", "INFO")
         with st.spinner("Test..."):
-            results = wikidata_search("test")
+            results = wikidata_search("test", use_cache=False)
         if results:
             st.success(f"✅ Wikidata OK! {len(results)} résultats")
         else:
@@ -432,10 +819,20 @@ with main_col:
         st.rerun()
     
     if search_btn and search_query:
-        if source in ["Wikidata", "Les deux"]:
+        if source == "Les deux":
+            # Les deux API en parallèle: attente = max(wiki, insee) au lieu de la somme
+            with st.spinner("Wikidata + INSEE..."), ThreadPoolExecutor(max_workers=2) as ex:
+                f_wiki = ex.submit(run_collecting_logs, wikidata_search_prefetch, search_query)
+                f_insee = ex.submit(run_collecting_logs, insee_search, search_query)
+                # Logs versés sur le thread principal, une source après l'autre
+                st.session_state.wiki_results, wiki_logs = f_wiki.result()
+                st.session_state.insee_results, insee_logs = f_insee.result()
+                st.session_state.logs.extend(wiki_logs)
+                st.session_state.logs.extend(insee_logs)
+        elif source == "Wikidata":
             with st.spinner("Wikidata..."):
-                st.session_state.wiki_results = wikidata_search(search_query)
-        if source in ["INSEE", "Les deux"]:
+                st.session_state.wiki_results = wikidata_search_prefetch(search_query)
+        else:
             with st.spinner("INSEE..."):
                 st.session_state.insee_results = insee_search(search_query)
         st.rerun()
@@ -443,7 +840,7 @@ with main_col:
     # Résultats Wikidata
     if st.session_state.wiki_results:
         st.markdown(f"**🌐 Wikidata ({len(st.session_state.wiki_results)})**")
-        for i, item in enumerate(st.session_state.wiki_results[:8]):
+        for i, item in enumerate(st.session_state.wiki_results[:WIKI_RESULTS_SHOWN]):
             c1, c2, c3 = st.columns([2, 5, 2])
             with c1:
                 st.code(item['qid'], language=None)
@@ -461,7 +858,7 @@ with main_col:
                     e.name = details['name_fr'] or item['label']
                     e.name_en = details['name_en']
                     e.description_fr = details['desc_fr']
-                    e.siren = e.siren or details['siren']
+                    e.siren = e.siren or clean_siren(details['siren'])
                     e.lei = details['lei']
                     e.website = e.website or details['website']
                     e.parent_org_qid = details['parent_qid']
@@ -504,44 +901,47 @@ with main_col:
         tabs = st.tabs(["Identité", "Filiation", "JSON-LD"])
         
         with tabs[0]:
-            c1, c2 = st.columns(2)
-            with c1:
-                e.name = st.text_input("Nom", e.name)
-                e.siren = st.text_input("SIREN", e.siren)
-                e.qid = st.text_input("QID", e.qid)
-            with c2:
-                e.website = st.text_input("Website", e.website)
-                e.lei = st.text_input("LEI", e.lei)
-                e.org_type = st.selectbox("Type", ["Organization", "Corporation", "LocalBusiness", "BankOrCreditUnion"])
+            # Formulaire: pas de rerun tant que "Appliquer" n'est pas cliqué
+            with st.form("identity", clear_on_submit=False):
+                c1, c2 = st.columns(2)
+                with c1:
+                    name = st.text_input("Nom", e.name)
+                    siren = st.text_input("SIREN", e.siren)
+                    qid = st.text_input("QID", e.qid)
+                with c2:
+                    website = st.text_input("Website", e.website)
+                    lei = st.text_input("LEI", e.lei)
+                    org_type = st.selectbox("Type", ORG_TYPES, index=ORG_TYPE_INDEX.get(e.org_type, 0))
+                if st.form_submit_button("Appliquer"):
+                    e.name, e.siren, e.qid = name, clean_siren(siren), qid.strip().upper()
+                    e.website, e.lei, e.org_type = website.strip(), lei.strip().upper(), org_type
+                    for label, value, rx in (("SIREN", e.siren, SIREN_RE), ("QID", e.qid, QID_RE), ("LEI", e.lei, LEI_RE)):
+                        if value and not rx.match(value):
+                            log(f"{label} au format invalide: '{value}'", "WARN")
+                    log(f"Identité mise à jour: {e.name}", "OK")
+                    st.rerun()
         
         with tabs[1]:
-            c1, c2 = st.columns(2)
-            with c1:
-                e.parent_org_name = st.text_input("Parent Name", e.parent_org_name)
-            with c2:
-                e.parent_org_qid = st.text_input("Parent QID", e.parent_org_qid)
-            if e.parent_org_qid:
+            with st.form("filiation", clear_on_submit=False):
+                c1, c2 = st.columns(2)
+                with c1:
+                    parent_name = st.text_input("Parent Name", e.parent_org_name)
+                with c2:
+                    parent_qid = st.text_input("Parent QID", e.parent_org_qid)
+                if st.form_submit_button("Appliquer"):
+                    e.parent_org_name, e.parent_org_qid = parent_name, parent_qid.strip().upper()
+                    if e.parent_org_qid and not QID_RE.match(e.parent_org_qid):
+                        log(f"Parent QID au format invalide: '{e.parent_org_qid}'", "WARN")
+                    log(f"Filiation mise à jour: {e.parent_org_name}", "OK")
+                    st.rerun()
+            if QID_RE.match(e.parent_org_qid):
                 st.success(f"✅ [{e.parent_org_name}](https://www.wikidata.org/wiki/{e.parent_org_qid})")
         
         with tabs[2]:
-            json_ld = {
-                "@context": "https://schema.org",
-                "@type": e.org_type,
-                "name": e.name,
-                "url": e.website or None,
-                "taxID": f"FR{e.siren}" if e.siren else None,
-                "sameAs": f"https://www.wikidata.org/wiki/{e.qid}" if e.qid else None,
-                "parentOrganization": {
-                    "@type": "Organization",
-                    "name": e.parent_org_name,
-                    "sameAs": f"https://www.wikidata.org/wiki/{e.parent_org_qid}"
-                } if e.parent_org_name else None
-            }
-            # Clean None values
-            json_ld = {k: v for k, v in json_ld.items() if v is not None}
+            json_str = export_json_ld(asdict(e))
             
-            st.json(json_ld)
-            st.download_button("💾 Download", json.dumps(json_ld, indent=2), "schema.json")
+            st.json(json_str)
+            st.download_button("💾 Download", json_str, "schema.json")
     else:
         st.info("👆 Recherchez une organisation")
 